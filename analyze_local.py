@@ -16,7 +16,7 @@ from app.services.defects.extractor import defect_extractor
 from app.services.defects.clustering import defect_clusterer
 from typing import Dict, Any
 from app.services.audit.auditor import ResultAuditor
-from app.models.testcase import TestCase
+from app.schemas.runtime import TestCase
 from app.services.llm.client import llm_client
 
 async def analyze_file(file_path: str):
@@ -62,18 +62,11 @@ async def analyze_file(file_path: str):
         stats = stats_service.compute_stats(cases)
         print(f"      通过率: {stats.get('pass_rate')}%")
 
-        # 5. Defect Extraction
+        # 5. Defect Extraction (extractor links case <-> analysis both ways)
         print("\n[4/6] 提取缺陷事实 (LLM 并发)...")
-        defects = await defect_extractor.extract_defect_facts_concurrently(cases)
-        print(f"      提取了 {len(defects)} 条缺陷分析。")
+        linked_defects = await defect_extractor.extract_defect_facts_concurrently(cases)
+        print(f"      提取了 {len(linked_defects)} 条缺陷分析。")
 
-        # Manual linking for in-memory processing (skipping DB)
-        linked_defects = []
-        for c in cases:
-            if hasattr(c, 'defect_analysis') and c.defect_analysis:
-                c.defect_analysis.testcase = c  # Bidirectional link for template
-                linked_defects.append(c.defect_analysis)
-        
         # 6. Clustering
         print("\n[5/6] 缺陷聚类 (LLM)...")
         clusters = await defect_clusterer.cluster_and_summarize_async(linked_defects, job_id)
@@ -94,9 +87,9 @@ async def analyze_file(file_path: str):
             "suspicious_cases": [c.dict() if hasattr(c, "dict") else c for c in suspicious_cases],
             "cases": [c.dict() if hasattr(c, "dict") else c for c in cases],
         }
-        import json
-        with open(result_path, "w", encoding="utf-8") as f:
-            json.dump(result, f, ensure_ascii=False, indent=2)
+        import orjson
+        with open(result_path, "wb") as f:
+            f.write(orjson.dumps(result, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY))
         print(f"\n成功! 结果已生成:\n{os.path.abspath(result_path)}")
         
         # Print Token Usage
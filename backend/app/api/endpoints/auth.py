@@ -1,3 +1,4 @@
+import hmac
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 from app.core.config import settings
@@ -14,7 +15,10 @@ def login(req: LoginReq):
     # Simple dev-only auth using env credentials if provided
     expected_user = getattr(settings, "AUTH_USERNAME", "admin")
     expected_pass = getattr(settings, "AUTH_PASSWORD", "admin")
-    if req.username != expected_user or req.password != expected_pass:
+    # Constant-time comparison; `&` instead of `and` so both checks always run
+    user_ok = hmac.compare_digest(req.username.encode("utf-8"), expected_user.encode("utf-8"))
+    pass_ok = hmac.compare_digest(req.password.encode("utf-8"), expected_pass.encode("utf-8"))
+    if not (user_ok & pass_ok):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     token = create_access_token(subject=req.username)
     return {"access_token": token, "token_type": "bearer"}
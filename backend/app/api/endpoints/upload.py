@@ -4,37 +4,70 @@ from app.services.ingest.tagging import module_tagger
 from app.services.analytics.stats import stats_service
 from app.services.defects.extractor import defect_extractor
 from app.services.defects.clustering import defect_clusterer
+from app.services.defects.pipeline import pipeline_service
+from app.services.llm.concurrency import llm_semaphore
+from app.core.config import settings
 from app.services.audit.auditor import ResultAuditor
-from app.models.testcase import TestCase
-from app.models.defect import DefectAnalysis, DefectCluster
+from app.schemas.runtime import TestCase, DefectAnalysis, DefectCluster
 from app.services.report_gen.renderer import report_generator
-from typing import Dict, Any, List
-import shutil
+from app.services.state.store import job_store
+from typing import Dict, Any, List, Optional
+from cachetools import TTLCache
+import aiofiles
 import os
 import uuid
 import asyncio
-from fastapi.responses import RedirectResponse
+from fastapi.responses import RedirectResponse, StreamingResponse
 
 router = APIRouter()
 
-job_logs: Dict[str, List[str]] = {}
-job_meta: Dict[str, Dict[str, Any]] = {}
-job_tasks: Dict[str, asyncio.Task] = {}
 JOB_TIMEOUT_SECONDS = 3600
+# Matches the job TTL in the Redis store: anything a crashed or abandoned job
+# leaves behind in this process is evicted after a day instead of living in
+# RSS for the server's lifetime.
+JOB_STATE_TTL_SECONDS = 86400
+TERMINAL_STATUSES = {"completed", "failed", "cancelled"}
 
+# Task handles must stay process-local (they wrap this worker's coroutines);
+# all queryable job state lives in the Redis-backed job_store.
+job_tasks: "TTLCache[str, asyncio.Task]" = TTLCache(maxsize=10000, ttl=JOB_STATE_TTL_SECONDS)
+# Per-job lists of subscriber queues feeding the SSE stream endpoint. Each
+# connection registers its own queue so concurrent subscribers all see every
+# line; nothing is buffered for subscribers that never connect.
+job_subscribers: "TTLCache[str, List[asyncio.Queue]]" = TTLCache(maxsize=10000, ttl=JOB_STATE_TTL_SECONDS)
 
-def append_log(job_id: str, message: str) -> None:
-    if job_id not in job_logs:
-        job_logs[job_id] = []
-    job_logs[job_id].append(message)
 
+async def append_log(job_id: str, message: str) -> None:
+    seq = await job_store.append_log(job_id, message)
+    for queue in job_subscribers.get(job_id, []):
+        queue.put_nowait((seq, message))
 
-def ensure_not_cancelled(job_id: str) -> None:
-    meta = job_meta.get(job_id)
-    if meta and meta.get("status") == "cancelling":
+
+async def ensure_not_cancelled(job_id: str) -> None:
+    if await job_store.is_cancel_requested(job_id):
         raise asyncio.CancelledError()
 
 
+def advise_sequential_read(file_path: str) -> None:
+    """
+    Hint the kernel to prefetch the file into the page cache before parsing.
+    The freshly written upload is about to be read front-to-back, so
+    WILLNEED + SEQUENTIAL lets readahead overlap with parser startup.
+    No-op on platforms without posix_fadvise.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        finally:
+            os.close(fd)
+    except OSError:
+        pass
+
+
 @router.post("/upload")
 async def upload_file(file: UploadFile = File(...)):
     job_id = str(uuid.uuid4())
@@ -42,12 +75,15 @@ async def upload_file(file: UploadFile = File(...)):
     os.makedirs(upload_dir, exist_ok=True)
     file_path = os.path.join(upload_dir, f"{job_id}_{file.filename}")
     
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Stream the upload in 1 MB chunks so the event loop is never blocked
+    # for the duration of a large file write.
+    async with aiofiles.open(file_path, "wb") as buffer:
+        while chunk := await file.read(1 << 20):
+            await buffer.write(chunk)
 
-    job_logs[job_id] = []
-    job_meta[job_id] = {"status": "pending", "report_url": None, "error": None}
-    append_log(job_id, "文件已上传，等待开始处理。")
+    await job_store.update_meta(job_id, {"status": "pending", "report_url": None, "error": None})
+    job_subscribers[job_id] = []
+    await append_log(job_id, "文件已上传，等待开始处理。")
     task = asyncio.create_task(run_local_pipeline_with_timeout(job_id, file_path))
     job_tasks[job_id] = task
 
@@ -61,78 +97,97 @@ async def run_local_pipeline_with_timeout(job_id: str, file_path: str) -> None:
     try:
         await asyncio.wait_for(run_local_pipeline(job_id, file_path), timeout=JOB_TIMEOUT_SECONDS)
     except asyncio.TimeoutError:
-        job_meta[job_id]["status"] = "failed"
-        job_meta[job_id]["error"] = f"任务执行超时（超过 {JOB_TIMEOUT_SECONDS} 秒），请重试或缩小数据量。"
-        append_log(job_id, f"流水线执行超时，已终止。超时时间: {JOB_TIMEOUT_SECONDS} 秒。")
+        await job_store.update_meta(job_id, {"status": "failed", "error": f"任务执行超时（超过 {JOB_TIMEOUT_SECONDS} 秒），请重试或缩小数据量。"})
+        await append_log(job_id, f"流水线执行超时，已终止。超时时间: {JOB_TIMEOUT_SECONDS} 秒。")
     except asyncio.CancelledError:
-        job_meta[job_id]["status"] = "cancelled"
-        job_meta[job_id]["error"] = "任务已被用户取消。"
-        append_log(job_id, "流水线已被用户取消。")
+        await job_store.update_meta(job_id, {"status": "cancelled", "error": "任务已被用户取消。"})
+        await append_log(job_id, "流水线已被用户取消。")
         raise
     finally:
         job_tasks.pop(job_id, None)
+        # Wake up any SSE subscribers so their streams can close
+        for queue in job_subscribers.pop(job_id, []):
+            queue.put_nowait(None)
 
 
 async def run_local_pipeline(job_id: str, file_path: str) -> None:
-    job_meta[job_id]["status"] = "running"
+    await job_store.update_meta(job_id, {"status": "running"})
     try:
-        ensure_not_cancelled(job_id)
-        append_log(job_id, "步骤 1/6：解析 Excel 数据。")
+        await ensure_not_cancelled(job_id)
+        await append_log(job_id, "步骤 1/6：解析 Excel 数据。")
+        advise_sequential_read(file_path)
         raw_cases = await ingest_service.parse_excel(file_path, job_id)
         cases = [TestCase(**d) for d in raw_cases]
-        append_log(job_id, f"已解析 {len(cases)} 条用例。")
+        await append_log(job_id, f"已解析 {len(cases)} 条用例。")
 
-        ensure_not_cancelled(job_id)
-        append_log(job_id, "步骤 2/6：模块打标（LLM 并发）。")
+        await ensure_not_cancelled(job_id)
+        await append_log(job_id, "步骤 2/6：模块打标（LLM 并发）。")
         cases = await module_tagger.tag_cases_concurrently(cases)
 
-        ensure_not_cancelled(job_id)
-        append_log(job_id, "步骤 3/6：结果审计（LLM 并发检查假成功）。")
+        await ensure_not_cancelled(job_id)
+        await append_log(job_id, "步骤 3/6：结果审计（LLM 并发检查假成功）。")
         auditor = ResultAuditor()
         cases = await auditor.audit_cases_concurrently(cases)
         suspicious_cases = [c for c in cases if c.audit_status == "Flagged"]
-        append_log(job_id, f"发现 {len(suspicious_cases)} 个存疑用例。")
+        await append_log(job_id, f"发现 {len(suspicious_cases)} 个存疑用例。")
 
-        ensure_not_cancelled(job_id)
-        append_log(job_id, "步骤 4/6：计算统计数据。")
+        await ensure_not_cancelled(job_id)
+        await append_log(job_id, "步骤 4/6：计算统计数据。")
         stats = stats_service.compute_stats(cases)
 
-        ensure_not_cancelled(job_id)
-        append_log(job_id, "步骤 5/6：提取缺陷事实（LLM 并发）。")
-        defects = await defect_extractor.extract_defect_facts_concurrently(cases)
-        append_log(job_id, f"提取了 {len(defects)} 条缺陷分析。")
-        
+        await ensure_not_cancelled(job_id)
         linked_defects: List[DefectAnalysis] = []
-        for c in cases:
-            if hasattr(c, "defect_analysis") and c.defect_analysis:
-                c.defect_analysis.testcase = c
-                linked_defects.append(c.defect_analysis)
+        clusters: Optional[List[DefectCluster]] = None
 
-        ensure_not_cancelled(job_id)
-        append_log(job_id, "步骤 6/6：缺陷聚类并生成报告。")
-        clusters = await defect_clusterer.cluster_and_summarize_async(linked_defects, job_id)
+        if settings.DEFECT_COMBINED_ANALYSIS:
+            await append_log(job_id, "步骤 5/6：缺陷分析与聚类（LLM 合并调用）。")
+            failed_cases = [c for c in cases if c.normalized_result in ["Fail", "Blocked"]]
+            try:
+                linked_defects, clusters = await pipeline_service.analyze_and_cluster_async(failed_cases, job_id)
+                await append_log(job_id, f"提取了 {len(linked_defects)} 条缺陷分析，识别出 {len(clusters)} 个聚类。")
+            except Exception as exc:
+                await append_log(job_id, f"合并分析失败（{exc}），回退为两段式调用。")
+                clusters = None
+
+        if clusters is None:
+            await append_log(job_id, "步骤 5/6：提取缺陷事实（LLM 并发）。")
+            linked_defects = await defect_extractor.extract_defect_facts_concurrently(cases)
+            await append_log(job_id, f"提取了 {len(linked_defects)} 条缺陷分析。")
+
+            await append_log(job_id, "步骤 6/6：缺陷聚类并生成报告。")
+            clusters = await defect_clusterer.cluster_and_summarize_async(linked_defects, job_id)
+        else:
+            await append_log(job_id, "步骤 6/6：生成报告。")
+        await ensure_not_cancelled(job_id)
 
         project_root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(__file__)))))
         output_dir = os.path.join(project_root, "reports")
         os.makedirs(output_dir, exist_ok=True)
         filename = f"report_{job_id}.html"
         report_path = os.path.join(output_dir, filename)
-        report_generator.render_report(job_id, stats, linked_defects, clusters, suspicious_cases, cases, report_path)
+        # Rendering (and the summary LLM call inside it) is synchronous;
+        # run it off the event loop
+        await asyncio.to_thread(
+            report_generator.render_report,
+            job_id, stats, linked_defects, clusters, suspicious_cases, cases, report_path,
+        )
         report_url = f"/reports/{filename}"
-        job_meta[job_id]["status"] = "completed"
-        job_meta[job_id]["report_url"] = report_url
-        append_log(job_id, f"报告已生成：{report_url}")
-        append_log(job_id, "流水线执行完成。")
+        await job_store.update_meta(job_id, {
+            "status": "completed",
+            "report_url": report_url,
+            "llm_metrics": llm_semaphore.metrics(),
+        })
+        await append_log(job_id, f"报告已生成：{report_url}")
+        await append_log(job_id, "流水线执行完成。")
     except Exception as exc:
-        job_meta[job_id]["status"] = "failed"
-        job_meta[job_id]["error"] = str(exc)
-        append_log(job_id, f"流水线执行失败：{exc}")
+        await job_store.update_meta(job_id, {"status": "failed", "error": str(exc)})
+        await append_log(job_id, f"流水线执行失败：{exc}")
 
 
 @router.get("/status/{job_id}")
 async def get_job_status(job_id: str):
-    meta = job_meta.get(job_id)
-    logs = job_logs.get(job_id, [])
+    meta = await job_store.get_meta(job_id)
+    logs = await job_store.get_logs(job_id)
     if not meta:
         return {
             "job_id": job_id,
@@ -148,9 +203,60 @@ async def get_job_status(job_id: str):
     }
 
 
+@router.get("/status/{job_id}/stream")
+async def stream_job_logs(job_id: str):
+    """
+    Push log lines as Server-Sent Events instead of having the frontend
+    re-fetch the full log list on every poll. Already-recorded lines are
+    replayed first so late subscribers see the complete history; each
+    connection gets its own queue so concurrent subscribers all receive
+    every live line exactly once.
+    """
+    queue: asyncio.Queue = asyncio.Queue()
+    subscribers = job_subscribers.get(job_id)
+    # Register before the history snapshot so no line can fall between
+    # replay and subscription; lines in both are skipped by sequence number.
+    if subscribers is not None:
+        subscribers.append(queue)
+
+    async def event_gen():
+        try:
+            history = await job_store.get_logs(job_id)
+            for line in history:
+                yield f"data: {line}\n\n"
+            if subscribers is None:
+                # Job already finished (or unknown): history is all there is
+                return
+            replayed = len(history)
+            while True:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=15)
+                except asyncio.TimeoutError:
+                    # Comment line keeps idle connections alive through proxies
+                    yield ": keep-alive\n\n"
+                    meta = await job_store.get_meta(job_id)
+                    if meta and meta.get("status") in TERMINAL_STATUSES:
+                        return
+                    continue
+                if item is None:
+                    return
+                seq, message = item
+                if seq <= replayed:
+                    continue
+                yield f"data: {message}\n\n"
+        finally:
+            if subscribers is not None:
+                try:
+                    subscribers.remove(queue)
+                except ValueError:
+                    pass
+
+    return StreamingResponse(event_gen(), media_type="text/event-stream")
+
+
 @router.delete("/{job_id}")
 async def cancel_job(job_id: str):
-    meta = job_meta.get(job_id)
+    meta = await job_store.get_meta(job_id)
     if not meta:
         return {
             "job_id": job_id,
@@ -164,28 +270,25 @@ async def cancel_job(job_id: str):
             "status": status,
             "message": "Job already finished.",
         }
+    # Set the shared cancel flag first: if the job runs on another worker,
+    # its next ensure_not_cancelled checkpoint picks it up there.
+    await job_store.request_cancel(job_id)
+    await job_store.update_meta(job_id, {"status": "cancelling"})
+    await append_log(job_id, "收到取消请求，尝试终止流水线。")
     task = job_tasks.get(job_id)
     if task and not task.done():
-        append_log(job_id, "收到取消请求，尝试终止流水线。")
+        # Task lives in this worker; cancel it directly instead of waiting
+        # for the next checkpoint.
         task.cancel()
-        meta["status"] = "cancelling"
-        return {
-            "job_id": job_id,
-            "status": "cancelling",
-            "message": "Cancellation requested.",
-        }
-    meta["status"] = "failed"
-    meta["error"] = "未找到可取消的运行中任务。"
-    append_log(job_id, "取消请求失败：未找到运行中的任务。")
     return {
         "job_id": job_id,
-        "status": "failed",
-        "message": "No running task found to cancel.",
+        "status": "cancelling",
+        "message": "Cancellation requested.",
     }
 
 @router.get("/result/{job_id}")
 async def get_job_result(job_id: str):
-    meta = job_meta.get(job_id)
+    meta = await job_store.get_meta(job_id)
     if not meta or not meta.get("report_url"):
         return {"error": {"code": 404, "message": "Result not found"}}
     return RedirectResponse(url=meta["report_url"])
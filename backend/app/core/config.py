@@ -19,12 +19,20 @@ class Settings(BaseSettings):
     # LLM
     LLM_API_KEY: str
     LLM_MODEL: str = "glm-4-air"
+    LLM_EMBEDDING_MODEL: str = "embedding-3"
     LLM_TEMPERATURE: float = 0.3
     LLM_MAX_TOKENS: int = 10000
     LLM_CONCURRENCY: int = 20
     LLM_TIMEOUT: int = 60
     LLM_MAX_RETRIES: int = 2
 
+    # Pipeline
+    # Opt-in: combined extraction+clustering in one LLM call. Off by default
+    # because the single prompt grows with the failed-case count (no batching,
+    # dedup or local clustering), so it only suits small jobs; falls back to
+    # the two-stage path when the combined response cannot be parsed.
+    DEFECT_COMBINED_ANALYSIS: bool = False
+
     # Auth
     JWT_SECRET_KEY: str = "change_me_dev_secret"
     JWT_ALGORITHM: str = "HS256"
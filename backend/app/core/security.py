@@ -1,5 +1,8 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Any, Dict, Optional
+import threading
+import time
 import jwt
 from fastapi import HTTPException, status, Depends
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
@@ -7,15 +10,46 @@ from app.core.config import settings
 
 reuseable_oauth2 = HTTPBearer(auto_error=True)
 
+# Key material is parsed once at import instead of per request.
+_SECRET_BYTES = settings.JWT_SECRET_KEY.encode("utf-8")
+
+# token -> payload LRU so a client polling with the same bearer doesn't pay
+# signature verification on every request. Entries are dropped (and the token
+# re-verified, raising ExpiredSignatureError) once their exp claim passes.
+_TOKEN_CACHE: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+_TOKEN_CACHE_SIZE = 4096
+# get_current_user is a sync dependency, so FastAPI runs it in a threadpool;
+# the LRU bookkeeping (move_to_end racing popitem) needs a lock.
+_TOKEN_CACHE_LOCK = threading.Lock()
+
 def create_access_token(subject: str, expires_minutes: Optional[int] = None) -> str:
     expire = datetime.utcnow() + timedelta(minutes=expires_minutes or settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     payload = {"sub": subject, "exp": expire}
     return jwt.encode(payload, settings.JWT_SECRET_KEY, algorithm=settings.JWT_ALGORITHM)
 
+def _decode_token(token: str) -> Dict[str, Any]:
+    with _TOKEN_CACHE_LOCK:
+        payload = _TOKEN_CACHE.get(token)
+        if payload is not None:
+            exp = payload.get("exp")
+            if exp is None or exp > time.time():
+                _TOKEN_CACHE.move_to_end(token)
+                return payload
+            # Expired entry: evict and fall through so pyjwt raises properly
+            _TOKEN_CACHE.pop(token, None)
+    # Signature verification happens outside the lock; only the cache
+    # bookkeeping is serialized
+    payload = jwt.decode(token, _SECRET_BYTES, algorithms=[settings.JWT_ALGORITHM])
+    with _TOKEN_CACHE_LOCK:
+        _TOKEN_CACHE[token] = payload
+        while len(_TOKEN_CACHE) > _TOKEN_CACHE_SIZE:
+            _TOKEN_CACHE.popitem(last=False)
+    return payload
+
 def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(reuseable_oauth2)) -> str:
     token = credentials.credentials
     try:
-        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=[settings.JWT_ALGORITHM])
+        payload = _decode_token(token)
         return payload.get("sub") or "unknown"
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
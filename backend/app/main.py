@@ -1,17 +1,19 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from app.core.config import settings
 from app.api.api import api_router
 from app.core.logging import get_logger
 from app.db.base import Base
+from app.services.llm.client import llm_client
 import os
 
 logger = get_logger("main")
 
 app = FastAPI(
     title=settings.PROJECT_NAME,
+    default_response_class=ORJSONResponse,
     openapi_url=f"{settings.API_V1_STR}/openapi.json",
     docs_url=f"{settings.API_V1_STR}/docs",
     redoc_url=f"{settings.API_V1_STR}/redoc",
@@ -36,6 +38,10 @@ reports_dir = os.path.join(project_root, "reports")
 os.makedirs(reports_dir, exist_ok=True)
 app.mount("/reports", StaticFiles(directory=reports_dir, html=True), name="reports")
 
+@app.on_event("shutdown")
+def shutdown_llm_client():
+    llm_client.close()
+
 @app.get("/")
 def root():
     return {"message": "Welcome to Test Report Agent API"}
@@ -43,7 +49,7 @@ def root():
 # Unified error response
 @app.exception_handler(Exception)
 async def global_exception_handler(_, exc: Exception):
-    return JSONResponse(
+    return ORJSONResponse(
         status_code=500,
         content={"error": {"code": 500, "message": str(exc)}},
     )
@@ -0,0 +1,74 @@
+"""
+In-memory pipeline models.
+
+The local pipeline (upload endpoint and analyze_local.py) never persists
+cases: it builds tens of thousands of objects, threads them through the LLM
+stages and renders a report. SQLAlchemy ORM instances carry per-instance
+dict + instrumentation overhead that is wasted on that path, so the pipeline
+uses these slot-based msgspec Structs instead (C-speed construction, no
+__dict__). The ORM models in app/models remain the database schema.
+
+Structs keep gc enabled because case <-> defect_analysis references form
+cycles. The dict() methods exclude back-references for the same reason, so
+results serialize cleanly.
+"""
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+import msgspec
+
+class TestCase(msgspec.Struct, kw_only=True):
+    job_id: str
+    case_id: Optional[str] = None
+    case_name: str = ""
+    precondition: Optional[str] = None
+    steps: Optional[str] = None
+    expected: Optional[str] = None
+    actual: Optional[str] = None
+    test_result: str = ""
+    normalized_result: str = "Skipped"
+    priority: Optional[str] = None
+    executor: Optional[str] = None
+    exec_time: Optional[datetime] = None
+    remark: Optional[str] = None
+    module: Optional[str] = None
+    module_confidence: Optional[float] = None
+    source_file: str = ""
+    source_sheet: str = ""
+    source_row: int = 0
+    parse_warnings: List[str] = msgspec.field(default_factory=list)
+    audit_status: Optional[str] = "Unchecked"
+    audit_reason: Optional[str] = None
+    id: Optional[int] = None
+    defect_analysis: Optional["DefectAnalysis"] = None
+
+    def dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.__struct_fields__ if f != "defect_analysis"}
+
+class DefectAnalysis(msgspec.Struct, kw_only=True):
+    job_id: Optional[str] = None
+    testcase_id: Optional[int] = None
+    phenomenon: Optional[str] = None
+    observed_fact: Optional[str] = None
+    hypothesis: Optional[str] = None
+    evidence: Optional[List[str]] = msgspec.field(default_factory=list)
+    repro_steps: Optional[str] = None
+    severity_guess: Optional[str] = None
+    id: Optional[int] = None
+    testcase: Optional[TestCase] = None
+    cluster: Optional["DefectCluster"] = None
+
+    def dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.__struct_fields__ if f not in ("testcase", "cluster")}
+
+class DefectCluster(msgspec.Struct, kw_only=True):
+    job_id: str
+    cluster_name: str
+    summary: Optional[str] = ""
+    risk_assessment: Optional[str] = ""
+    root_cause_hypothesis: Optional[str] = ""
+    action_suggestion: Optional[str] = ""
+    id: Optional[int] = None
+    defects: List[DefectAnalysis] = msgspec.field(default_factory=list)
+
+    def dict(self) -> Dict[str, Any]:
+        return {f: getattr(self, f) for f in self.__struct_fields__ if f != "defects"}
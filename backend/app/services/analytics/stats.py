@@ -1,31 +1,39 @@
 from typing import List, Dict, Any
-from app.models.testcase import TestCase
-from collections import Counter
+import pandas as pd
+from app.schemas.runtime import TestCase
 
 class StatsService:
     def compute_stats(self, cases: List[TestCase]) -> Dict[str, Any]:
         total = len(cases)
         if total == 0:
             return {}
-            
-        result_counts = Counter(c.normalized_result for c in cases)
-        module_counts = Counter(c.module for c in cases)
-        
-        # Calculate Pass Rate
-        pass_count = result_counts.get("Pass", 0)
-        pass_rate = (pass_count / total) * 100 if total > 0 else 0
-        
-        # Top Failed Modules
-        failed_cases = [c for c in cases if c.normalized_result in ["Fail", "Blocked"]]
-        failed_modules = Counter(c.module for c in failed_cases)
-        
+
+        # Single column-wise pass instead of per-case Python loops
+        df = pd.DataFrame.from_records(
+            ((c.normalized_result, c.module) for c in cases),
+            columns=["normalized_result", "module"],
+        )
+
+        result_counts = df["normalized_result"].value_counts()
+        pass_rate = (df["normalized_result"] == "Pass").mean() * 100
+
+        module_counts = df["module"].value_counts(dropna=False)
+
+        failed = df[df["normalized_result"].isin(["Fail", "Blocked"])]
+        failed_modules = failed["module"].value_counts(dropna=False).head(5)
+
         stats = {
             "total_cases": total,
-            "results": dict(result_counts),
-            "pass_rate": round(pass_rate, 2),
-            "modules": dict(module_counts),
-            "top_failed_modules": dict(failed_modules.most_common(5))
+            "results": {k: int(v) for k, v in result_counts.items()},
+            "pass_rate": round(float(pass_rate), 2),
+            "modules": self._counts_to_dict(module_counts),
+            "top_failed_modules": self._counts_to_dict(failed_modules),
         }
         return stats
 
+    def _counts_to_dict(self, counts: pd.Series) -> Dict[Any, int]:
+        # Untagged cases have module=None; value_counts turns that into NaN,
+        # map it back so the output shape matches the old Counter-based dict
+        return {(None if pd.isna(k) else k): int(v) for k, v in counts.items()}
+
 stats_service = StatsService()
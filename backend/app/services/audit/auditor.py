@@ -2,8 +2,9 @@ from typing import List, Dict, Any
 from loguru import logger
 import json
 import asyncio
-from app.models.testcase import TestCase
+from app.schemas.runtime import TestCase
 from app.services.llm.client import LLMClient
+from app.services.llm.concurrency import llm_semaphore
 
 class ResultAuditor:
     def __init__(self):
@@ -32,11 +33,12 @@ class ResultAuditor:
     async def _audit_batch_async(self, batch: List[TestCase]):
         prompt = self._build_audit_prompt(batch)
         try:
-            response = await self.llm.achat_completion(
-                messages=[{"role": "user", "content": prompt}],
-                temperature=0.1, # Low temperature for strict analysis
-                response_format={"type": "json_object"}
-            )
+            async with llm_semaphore:
+                response = await self.llm.achat_completion(
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.1, # Low temperature for strict analysis
+                    response_format={"type": "json_object"}
+                )
             
             results = self._parse_llm_response(response)
             self._apply_audit_results(batch, results)
@@ -1,147 +1,138 @@
 import asyncio
-from typing import List, Dict, Any
-from app.models.defect import DefectAnalysis, DefectCluster
+import re
+from collections import Counter
+from typing import List, Dict, Any, Optional, Tuple
+import numpy as np
+from sklearn.cluster import HDBSCAN
+from app.schemas.runtime import DefectAnalysis, DefectCluster
 from app.core.logging import get_logger
 from app.services.llm.client import llm_client
 
 logger = get_logger("defect_clustering")
 
+# Static half of the cluster-naming prompt; the per-cluster phenomena list is
+# appended after it so the prefix stays byte-identical call to call (cheap to
+# build, and eligible for provider-side prefix caching).
+_SUMMARIZE_PROMPT_PREFIX = """
+你是一名资深测试架构师。以下缺陷已通过语义相似度被归为同一聚类，请为该聚类生成名称与分析结论。
+
+【输出字段含义】
+- cluster_name：简明聚类名称（建议 ≤12 字），推荐形式为“<模块>/<领域> - <问题类型>”，例如“支付/结算 - 接口超时问题”。
+- summary：用 1～2 句话概括聚类内缺陷的共同特征（典型场景 + 常见现象）。
+- root_cause_hypothesis：对可能的根本原因进行专业推测，即使不 100% 准确，也要给出合理假设。
+- risk_assessment：用“高/中/低 + 简短说明”的形式给出风险评估，例如“高 - 阻断核心支付流程，影响下单转化”。
+- action_suggestion：给出具体、可执行的改进建议，建议可以直接用作 Jira 任务标题。
+
+【输出格式】
+仅输出一个可直接由 json.loads() 解析的 JSON 对象，禁止包含任何解释、Markdown 或额外文本：
+{
+  "cluster_name": "简明聚类名称",
+  "summary": "共同特征描述（1～2句）",
+  "root_cause_hypothesis": "尽力推断的根本原因",
+  "risk_assessment": "高/中/低 + 影响说明",
+  "action_suggestion": "具体、可执行的改进建议"
+}
+"""
+
+# Cheap keyword rules applied before embedding: defects with an obvious
+# categorical marker are bucketed directly and never enter the embedding +
+# HDBSCAN pass. First matching rule wins.
+_SEED_RULES: List[Tuple[re.Pattern, str]] = [
+    (re.compile(r"支付|结算|pay", re.I), "支付/结算异常"),
+    (re.compile(r"登录|注册|鉴权|login|auth", re.I), "登录/鉴权异常"),
+    (re.compile(r"超时|timeout", re.I), "接口超时"),
+    (re.compile(r"\b5\d\d\b|服务器错误|内部错误", re.I), "服务端错误"),
+    (re.compile(r"\b4\d\d\b|未找到|无权限", re.I), "请求/权限错误"),
+]
+
 class DefectClusterer:
     async def cluster_and_summarize_async(self, defects: List[DefectAnalysis], job_id: str) -> List[DefectCluster]:
+        """
+        Cluster defects by embedding + HDBSCAN, then use the LLM only to name
+        and summarize each cluster.
+
+        The grouping itself is done locally on embedding vectors, so prompt
+        size no longer grows with the defect count; the LLM sees one small
+        prompt per cluster (phenomena only), dispatched concurrently. Noise
+        points (HDBSCAN label -1) land in the existing 待确认/孤立缺陷 bucket.
+        """
         if not defects:
             return []
 
-        # 1. Prepare data for LLM
-        # Use index as a temporary ID since database IDs might not be set yet
-        defect_map = {str(i): d for i, d in enumerate(defects)}
-        
-        defect_text_list = []
-        for i, d in enumerate(defects):
-            phenomenon = d.phenomenon or "无描述"
-            severity = d.severity_guess or "未知"
-            module = ""
-            if getattr(d, "testcase", None) is not None:
-                module = getattr(d.testcase, "module", "") or ""
-            module_text = module or "未知模块"
-            defect_text_list.append(f"ID: {i} | 模块: {module_text} | 严重级别: {severity} | 现象: {phenomenon}")
-        
-        defect_input = "\n".join(defect_text_list)
-
-        prompt = f"""
-        你是一名资深测试架构师，负责对本次测试中发现的所有缺陷进行深度分析与智能聚类。请根据以下缺陷列表，依据根本原因、表现现象或影响模块的语义相似性进行合理分组。
-
-        【缺陷列表】
-        {defect_input}
-
-        【关键原则：避免孤立缺陷】
-        1. 绝不轻易归为孤立：仅当缺陷描述完全缺失可分析的技术要素（如“系统错误”“功能异常”“无法复现”且无上下文）时，才归入“待确认/孤立缺陷”。
-        2. 优先聚类，再兜底：
-           - 若缺陷描述包含业务模块（如“支付”“用户中心”）、错误现象（如“超时”“404”）或错误码，必须尝试聚类，不得直接归为孤立。
-           - 例如：“登录失败”→聚类到“登录功能异常”；“支付超时”→聚类到“支付接口超时”。
-        3. 相似性判断标准：
-           - 相同模块 + 相似现象 = 可聚类（如“支付超时”和“支付回调丢失”→同属“支付异常”）。
-           - 相同现象但不同模块 = 不合并（如“登录超时”和“注册超时”→不同聚类）。
-           - 模糊描述：优先基于可提取的关键词、模块、用例路径进行聚类，而不是直接归为孤立。
-
-        【聚类原则】
-        1. 归属原则：每个缺陷必须归属一个聚类，禁止默认孤立。仅当描述无任何技术要素时，才归入“待确认/孤立缺陷”聚类。
-        2. 粒度控制：
-           - 聚类总数应在 3～7 个（不含“待确认/孤立缺陷”）。
-           - 若某聚类包含超过 7 个缺陷，检查是否可按错误码、子模块或更细颗粒度拆分。
-        3. 孤立缺陷处理：
-           - 仅限少量缺陷可归为“待确认/孤立缺陷”；如确实比例偏高，应在对应聚类的 summary 中说明“描述模糊/信息不足”。
-           - 对这些缺陷，仍需给出风险评估和改进建议（例如：建议补充日志、抓包或截图）。
-
-        【输出字段含义】
-        - cluster_name：简明聚类名称（建议 ≤12 字），推荐形式为“<模块>/<领域> - <问题类型>”，例如“支付/结算 - 接口超时问题”。
-        - summary：用 1～2 句话概括聚类内缺陷的共同特征（典型场景 + 常见现象）。
-        - root_cause_hypothesis：对可能的根本原因进行专业推测，即使不 100% 准确，也要给出合理假设，例如“可能因缓存未刷新导致状态不同步”。
-        - risk_assessment：用“高/中/低 + 简短说明”的形式给出风险评估，例如“高 - 阻断核心支付流程，影响下单转化”。
-        - action_suggestion：给出具体、可执行的改进建议，建议可以直接用作 Jira 任务标题，例如“为订单状态更新接口增加重试和幂等校验”。
-
-        【对模糊/低质量缺陷的处理】
-        - 若某条缺陷描述较模糊（如只写“功能异常”），优先结合模块信息、现象关键词尝试归类到最相近的聚类。
-        - 仅当无法找到任何合理归属时，才放入“待确认/孤立缺陷”聚类，并在 summary 中说明“描述缺失关键信息”。
-        - 对这类缺陷的 action_suggestion 中，给出“建议补充日志或截图”等后续动作提示。
-
-        【输出格式】
-        请严格输出单行、标准、可直接由 Python json.loads() 解析的 JSON 字符串。禁止包含任何解释、Markdown 或额外文本。所有字符串中的双引号必须转义为\\"。
-
-        JSON 结构示例（仅示意，实际返回内容需结合输入缺陷列表）：
-        {{
-          "clusters": [
-            {{
-              "cluster_name": "简明聚类名称",
-              "summary": "共同特征描述（1～2句）",
-              "root_cause_hypothesis": "尽力推断的根本原因（避免占位语）",
-              "risk_assessment": "高/中/低 + 影响说明",
-              "action_suggestion": "具体、可执行的改进建议（可直接作为 Jira 标题）",
-              "defect_ids": ["ID1", "ID2"]
-            }}
-          ]
-        }}
-        """
+        # With a handful of defects there is nothing meaningful to cluster;
+        # skip the embedding + LLM round-trips entirely (common in dev/demo runs)
+        if len(defects) <= 3:
+            return [self._small_job_cluster(defects, job_id)]
 
         clusters = []
-        
+
         try:
-            # 2. Call LLM to cluster and summarize
-            response = await llm_client.achat_completion([{"role": "user", "content": prompt}], response_format=dict)
-            
-            if isinstance(response, dict) and "clusters" in response:
-                llm_clusters = response["clusters"]
-                
-                # Track which defects have been assigned to avoid duplicates (though LLM instruction says exclusive)
-                assigned_indices = set()
-                
-                for cluster_data in llm_clusters:
-                    defect_ids = cluster_data.get("defect_ids", [])
-                    cluster = DefectCluster(
-                        job_id=job_id,
-                        cluster_name=cluster_data.get("cluster_name", "未知聚类"),
-                        summary=cluster_data.get("summary", ""),
-                        risk_assessment=cluster_data.get("risk_assessment", "")
-                    )
-                    setattr(cluster, "root_cause_hypothesis", cluster_data.get("root_cause_hypothesis", ""))
-                    setattr(cluster, "action_suggestion", cluster_data.get("action_suggestion", ""))
-                    cluster_defects = []
-                    for did in defect_ids:
-                        did_str = str(did)
-                        if did_str in defect_map:
-                            d = defect_map[did_str]
-                            d.cluster = cluster
-                            cluster_defects.append(d)
-                            assigned_indices.add(did_str)
-                    
-                    # Only add cluster if it has defects
-                    if cluster_defects:
-                        cluster.defects = cluster_defects # Assuming ORM allows this or we handle it later
-                        clusters.append(cluster)
-                
-                # 3. Handle unassigned defects (Fallback)
-                unassigned_defects = []
-                for i in range(len(defects)):
-                    if str(i) not in assigned_indices:
-                        unassigned_defects.append(defect_map[str(i)])
-                
-                if unassigned_defects:
-                    fallback_cluster = DefectCluster(
-                        job_id=job_id,
-                        cluster_name="待确认/孤立缺陷",
-                        summary="部分缺陷描述缺失关键信息，无法可靠判断模块或根因，暂归为待确认/孤立缺陷。",
-                        risk_assessment="中 - 具体风险待根据补充信息评估"
-                    )
-                    setattr(fallback_cluster, "root_cause_hypothesis", "当前缺陷描述信息不足，仅能判断存在异常，无法可靠推断具体根本原因。")
-                    setattr(fallback_cluster, "action_suggestion", "请补充相关日志、请求参数、截图或更详细的缺陷描述后，再进行重新归类与评估。")
-                    for d in unassigned_defects:
-                        d.cluster = fallback_cluster
-                    clusters.append(fallback_cluster)
-                    
-            else:
-                raise ValueError("LLM response missing 'clusters' key")
-                
+            # 0. Keyword pre-filter: obvious categories skip the embedding path
+            seed_buckets: Dict[str, List[DefectAnalysis]] = {}
+            unseeded: List[DefectAnalysis] = []
+            for d in defects:
+                seed_label = self._seed_label(d)
+                if seed_label is not None:
+                    seed_buckets.setdefault(seed_label, []).append(d)
+                else:
+                    unseeded.append(d)
+
+            # 1. Embed "phenomenon||module" for the rest and group locally
+            grouped: Dict[int, List[DefectAnalysis]] = {}
+            noise_defects: List[DefectAnalysis] = []
+            if unseeded:
+                texts = [self._defect_text(d) for d in unseeded]
+                vectors = await llm_client.aembeddings(texts)
+                matrix = np.asarray(vectors, dtype=np.float32)
+                # Normalize so euclidean distance is monotonic in cosine distance
+                norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+                matrix = matrix / np.clip(norms, 1e-12, None)
+
+                labels = self._cluster_labels(matrix)
+                for label, defect in zip(labels, unseeded):
+                    grouped.setdefault(int(label), []).append(defect)
+
+                noise_defects = grouped.pop(-1, [])
+
+            # 2. One small LLM call per group, concurrently, for naming only;
+            # seed buckets keep their rule label as the fallback name
+            groups: List[Tuple[str, List[DefectAnalysis]]] = list(seed_buckets.items())
+            groups.extend((f"缺陷聚类 {label + 1}", grouped[label]) for label in sorted(grouped))
+
+            tasks = [self._summarize_cluster_async(group) for _, group in groups]
+            summaries = await asyncio.gather(*tasks)
+
+            for (default_name, cluster_defects), summary_data in zip(groups, summaries):
+                cluster = DefectCluster(
+                    job_id=job_id,
+                    cluster_name=summary_data.get("cluster_name", default_name),
+                    summary=summary_data.get("summary", ""),
+                    risk_assessment=summary_data.get("risk_assessment", "")
+                )
+                setattr(cluster, "root_cause_hypothesis", summary_data.get("root_cause_hypothesis", ""))
+                setattr(cluster, "action_suggestion", summary_data.get("action_suggestion", ""))
+                for d in cluster_defects:
+                    d.cluster = cluster
+                cluster.defects = cluster_defects
+                clusters.append(cluster)
+
+            # 3. Noise points fall into the existing fallback bucket
+            if noise_defects:
+                fallback_cluster = DefectCluster(
+                    job_id=job_id,
+                    cluster_name="待确认/孤立缺陷",
+                    summary="部分缺陷与其他缺陷的语义相似度过低，无法可靠归入任何聚类，暂归为待确认/孤立缺陷。",
+                    risk_assessment="中 - 具体风险待根据补充信息评估"
+                )
+                setattr(fallback_cluster, "root_cause_hypothesis", "当前缺陷描述信息不足或现象较为孤立，无法可靠推断具体根本原因。")
+                setattr(fallback_cluster, "action_suggestion", "请补充相关日志、请求参数、截图或更详细的缺陷描述后，再进行重新归类与评估。")
+                for d in noise_defects:
+                    d.cluster = fallback_cluster
+                fallback_cluster.defects = noise_defects
+                clusters.append(fallback_cluster)
+
         except Exception as e:
-            logger.error(f"LLM Clustering failed: {e}")
+            logger.error(f"Clustering failed: {e}")
             # Fallback: Put everything in one cluster
             fallback_cluster = DefectCluster(
                 job_id=job_id,
@@ -153,8 +144,66 @@ class DefectClusterer:
             setattr(fallback_cluster, "action_suggestion", "请暂时人工审阅全部缺陷列表，手工完成聚类和优先级评估，或在恢复 AI 服务后重新执行聚类。")
             for d in defects:
                 d.cluster = fallback_cluster
-            clusters.append(fallback_cluster)
+            fallback_cluster.defects = list(defects)
+            clusters = [fallback_cluster]
 
         return clusters
 
+    def _small_job_cluster(self, defects: List[DefectAnalysis], job_id: str) -> DefectCluster:
+        modules = Counter(
+            (getattr(d.testcase, "module", None) if getattr(d, "testcase", None) is not None else None) or "未知模块"
+            for d in defects
+        )
+        top_module = modules.most_common(1)[0][0]
+        cluster = DefectCluster(
+            job_id=job_id,
+            cluster_name=f"{top_module} - 少量缺陷",
+            summary=f"本次仅发现 {len(defects)} 条缺陷，样本过少，不足以进行自动聚类，暂归为一组。",
+            risk_assessment="中 - 缺陷数量少，建议逐条人工评估业务影响"
+        )
+        setattr(cluster, "root_cause_hypothesis", "缺陷数量过少，无法基于相似性推断共同根因，请参考各缺陷自身的根因假设。")
+        setattr(cluster, "action_suggestion", "请逐条审阅缺陷详情并分别跟进修复。")
+        for d in defects:
+            d.cluster = cluster
+        cluster.defects = list(defects)
+        return cluster
+
+    def _seed_label(self, defect: DefectAnalysis) -> Optional[str]:
+        text = defect.phenomenon or ""
+        for pattern, label in _SEED_RULES:
+            if pattern.search(text):
+                return label
+        return None
+
+    def _defect_text(self, defect: DefectAnalysis) -> str:
+        phenomenon = defect.phenomenon or "无描述"
+        module = ""
+        if getattr(defect, "testcase", None) is not None:
+            module = getattr(defect.testcase, "module", "") or ""
+        return f"{phenomenon}||{module or '未知模块'}"
+
+    def _cluster_labels(self, matrix: np.ndarray) -> np.ndarray:
+        min_cluster_size = 3
+        if len(matrix) <= min_cluster_size:
+            # Too few samples for density estimation; treat as one group
+            return np.zeros(len(matrix), dtype=int)
+        clusterer = HDBSCAN(min_cluster_size=min_cluster_size)
+        return clusterer.fit_predict(matrix)
+
+    async def _summarize_cluster_async(self, cluster_defects: List[DefectAnalysis]) -> Dict[str, Any]:
+        phenomena = "\n".join(
+            f"- {d.phenomenon or '无描述'} (严重级别: {d.severity_guess or '未知'})"
+            for d in cluster_defects
+        )
+
+        prompt = _SUMMARIZE_PROMPT_PREFIX + "\n【聚类内缺陷现象列表】\n" + phenomena
+
+        try:
+            response = await llm_client.achat_completion([{"role": "user", "content": prompt}], response_format=dict)
+            if isinstance(response, dict):
+                return response
+        except Exception as e:
+            logger.error(f"Cluster summarization failed: {e}")
+        return {}
+
 defect_clusterer = DefectClusterer()
@@ -0,0 +1,160 @@
+from typing import List, Tuple
+import json
+from app.schemas.runtime import TestCase, DefectAnalysis, DefectCluster
+from app.services.llm.client import llm_client
+from app.core.logging import get_logger
+
+logger = get_logger("defect_pipeline")
+
+class DefectPipeline:
+    async def analyze_and_cluster_async(self, failed_cases: List[TestCase], job_id: str) -> Tuple[List[DefectAnalysis], List[DefectCluster]]:
+        """
+        Combined defect extraction + clustering in one LLM call.
+
+        The two-stage path (extractor then clusterer) pays a second round-trip
+        and re-serializes the stage-5 output as the stage-6 input. Here the raw
+        failed-case fields go in once and both `defects` and `clusters` come
+        back in a single response. Raises on any failure so the caller can fall
+        back to the two-call path.
+        """
+        if not failed_cases:
+            return [], []
+
+        case_input = []
+        for idx, case in enumerate(failed_cases):
+            case_input.append({
+                "idx": idx,
+                "case_name": case.case_name,
+                "steps": case.steps,
+                "expected": case.expected,
+                "actual": case.actual,
+                "remark": case.remark,
+                "module": getattr(case, "module", None),
+            })
+
+        prompt = f"""
+        你是一名资深测试架构师。请对下面的失败用例列表完成两项任务：
+        1. 对每条用例进行缺陷事实抽取（phenomenon / observed_fact / hypothesis / evidence / repro_steps / severity_guess）。
+        2. 基于抽取结果，按根本原因、表现现象或影响模块的语义相似性对缺陷进行聚类。
+
+        【输入用例列表 (JSON)】
+        {json.dumps(case_input, ensure_ascii=False)}
+
+        【缺陷抽取字段要求】
+        - phenomenon: 一句话概括缺陷现象，推荐格式 "【受影响模块】场景简述 - 具体错误现象"，必须包含功能模块、操作场景、用户可见异常结果。
+        - observed_fact: 站在日志/页面观察的角度客观描述系统真实行为，不写推测。
+        - hypothesis: 推荐格式 "类型: <根因类别>; 详情: <详细推断>"，根因类别从 "需求缺陷", "实现逻辑错误", "接口契约不一致", "配置错误", "数据边界/空值处理缺陷", "并发/时序问题", "兼容性问题", "环境/部署问题", "第三方依赖问题", "性能问题", "安全问题", "测试数据问题", "用例设计问题", "其他" 中选择。
+        - evidence: 字符串数组，每个元素是支持推测的证据片段，尽量保持原文引用。
+        - repro_steps: 从零开始可以稳定复现该缺陷的最少操作步骤，多步自然语言描述。
+        - severity_guess: "Critical"（核心流程不可用/严重数据错误）、"Major"（主要功能受影响但可局部绕过）、"Minor"（次要功能或展示问题）三选一。
+
+        【聚类原则】
+        1. 每个缺陷必须归属一个聚类，禁止默认孤立；仅当描述完全缺失可分析的技术要素时，才归入"待确认/孤立缺陷"。
+        2. 聚类总数应在 3～7 个（不含"待确认/孤立缺陷"）；相同模块 + 相似现象可聚类，相同现象但不同模块不合并。
+        3. cluster_name 简明（建议 ≤12 字），推荐形式"<模块>/<领域> - <问题类型>"。
+        4. summary 用 1～2 句话概括聚类内缺陷的共同特征；root_cause_hypothesis 给出合理的根因假设；risk_assessment 用"高/中/低 + 简短说明"；action_suggestion 给出可直接用作 Jira 任务标题的改进建议。
+
+        【输出格式】
+        仅输出一个合法的 JSON 字符串，禁止包含任何解释、Markdown 或额外文本。结构如下：
+        {{
+          "defects": [
+            {{
+              "idx": 0,
+              "phenomenon": "...",
+              "observed_fact": "...",
+              "hypothesis": "...",
+              "evidence": ["..."],
+              "repro_steps": "...",
+              "severity_guess": "Critical/Major/Minor 三选一"
+            }}
+          ],
+          "clusters": [
+            {{
+              "cluster_name": "简明聚类名称",
+              "summary": "共同特征描述（1～2句）",
+              "root_cause_hypothesis": "尽力推断的根本原因",
+              "risk_assessment": "高/中/低 + 影响说明",
+              "action_suggestion": "具体、可执行的改进建议",
+              "defect_ids": [0, 1]
+            }}
+          ]
+        }}
+        """
+
+        response = await llm_client.achat_completion([{"role": "user", "content": prompt}], response_format=dict)
+
+        if not isinstance(response, dict) or "defects" not in response or "clusters" not in response:
+            raise ValueError("Combined analysis response missing 'defects'/'clusters' keys")
+
+        # 1. Build DefectAnalysis objects and link them to their cases
+        analyses_by_idx = {}
+        for item in response["defects"]:
+            if not isinstance(item, dict):
+                continue
+            idx = item.get("idx")
+            if idx is None or not (0 <= int(idx) < len(failed_cases)):
+                continue
+            case = failed_cases[int(idx)]
+            analysis = DefectAnalysis(
+                testcase_id=case.id,
+                phenomenon=item.get("phenomenon"),
+                observed_fact=item.get("observed_fact"),
+                hypothesis=item.get("hypothesis"),
+                evidence=item.get("evidence", []),
+                repro_steps=item.get("repro_steps"),
+                severity_guess=item.get("severity_guess")
+            )
+            case.defect_analysis = analysis
+            analysis.testcase = case
+            analyses_by_idx[int(idx)] = analysis
+
+        # 2. Build clusters, mapping defect_ids back by idx
+        clusters: List[DefectCluster] = []
+        assigned = set()
+        for cluster_data in response["clusters"]:
+            if not isinstance(cluster_data, dict):
+                continue
+            cluster = DefectCluster(
+                job_id=job_id,
+                cluster_name=cluster_data.get("cluster_name", "未知聚类"),
+                summary=cluster_data.get("summary", ""),
+                risk_assessment=cluster_data.get("risk_assessment", "")
+            )
+            setattr(cluster, "root_cause_hypothesis", cluster_data.get("root_cause_hypothesis", ""))
+            setattr(cluster, "action_suggestion", cluster_data.get("action_suggestion", ""))
+            cluster_defects = []
+            for did in cluster_data.get("defect_ids", []):
+                try:
+                    did_int = int(did)
+                except (TypeError, ValueError):
+                    continue
+                if did_int in analyses_by_idx and did_int not in assigned:
+                    d = analyses_by_idx[did_int]
+                    d.cluster = cluster
+                    cluster_defects.append(d)
+                    assigned.add(did_int)
+            if cluster_defects:
+                cluster.defects = cluster_defects
+                clusters.append(cluster)
+
+        # 3. Fallback bucket for defects the LLM left unassigned
+        unassigned = [analyses_by_idx[i] for i in analyses_by_idx if i not in assigned]
+        if unassigned:
+            fallback_cluster = DefectCluster(
+                job_id=job_id,
+                cluster_name="待确认/孤立缺陷",
+                summary="部分缺陷描述缺失关键信息，无法可靠判断模块或根因，暂归为待确认/孤立缺陷。",
+                risk_assessment="中 - 具体风险待根据补充信息评估"
+            )
+            setattr(fallback_cluster, "root_cause_hypothesis", "当前缺陷描述信息不足，仅能判断存在异常，无法可靠推断具体根本原因。")
+            setattr(fallback_cluster, "action_suggestion", "请补充相关日志、请求参数、截图或更详细的缺陷描述后，再进行重新归类与评估。")
+            for d in unassigned:
+                d.cluster = fallback_cluster
+            fallback_cluster.defects = unassigned
+            clusters.append(fallback_cluster)
+
+        defects = list(analyses_by_idx.values())
+        logger.info(f"Combined analysis produced {len(defects)} defects in {len(clusters)} clusters.")
+        return defects, clusters
+
+pipeline_service = DefectPipeline()
@@ -1,6 +1,8 @@
 import pandas as pd
 from typing import List, Dict, Any
+import asyncio
 import json
+from openpyxl import load_workbook
 from app.core.logging import get_logger
 from app.models.testcase import TestCase
 from app.services.llm.client import llm_client
@@ -12,11 +14,13 @@ class IngestService:
     async def parse_excel(self, file_path: str, job_id: str) -> List[Dict[str, Any]]:
         logger.info(f"Parsing Excel file: {file_path}")
         try:
-            xls = pd.ExcelFile(file_path)
+            # Stream the workbook in a worker thread: read-only mode iterates
+            # row values instead of materializing the full cell graph, and the
+            # event loop stays free while the file is read.
+            sheets = await asyncio.to_thread(self._read_sheets_streaming, file_path)
             all_cases = []
-            
-            for sheet_name in xls.sheet_names:
-                df = pd.read_excel(file_path, sheet_name=sheet_name)
+
+            for sheet_name, df in sheets.items():
                 df = self._preprocess_dataframe(df)
                 
                 # 1. LLM-based Column Alignment
@@ -41,6 +45,40 @@ class IngestService:
             logger.error(f"Failed to parse Excel: {e}")
             raise e
 
+    def _read_sheets_streaming(self, file_path: str) -> Dict[str, pd.DataFrame]:
+        """
+        Read all sheets via openpyxl read-only mode, row by row.
+
+        Mirrors pandas' default read_excel behavior (first row as header,
+        unnamed columns become "Unnamed: N") so downstream preprocessing
+        keeps working unchanged.
+        """
+        wb = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            sheets: Dict[str, pd.DataFrame] = {}
+            for ws in wb.worksheets:
+                rows = ws.iter_rows(values_only=True)
+                header = next(rows, None)
+                if header is None:
+                    continue
+                columns = [
+                    str(h).strip() if h is not None else f"Unnamed: {i}"
+                    for i, h in enumerate(header)
+                ]
+                width = len(columns)
+                data = []
+                for row in rows:
+                    # Normalize ragged rows to the header width
+                    if len(row) < width:
+                        row = tuple(row) + (None,) * (width - len(row))
+                    elif len(row) > width:
+                        row = row[:width]
+                    data.append(row)
+                sheets[ws.title] = pd.DataFrame(data, columns=columns)
+            return sheets
+        finally:
+            wb.close()
+
     def _preprocess_dataframe(self, df: pd.DataFrame) -> pd.DataFrame:
         if df is None or df.empty:
             return df
@@ -1,8 +1,9 @@
 from typing import List, Dict, Any
 import json
 import asyncio
-from app.models.testcase import TestCase
+from app.schemas.runtime import TestCase
 from app.services.llm.client import llm_client
+from app.services.llm.concurrency import llm_semaphore
 from app.core.logging import get_logger
 
 logger = get_logger("module_tagging")
@@ -57,7 +58,8 @@ class ModuleTagger:
         """
         
         try:
-            response = await llm_client.achat_completion([{"role": "user", "content": prompt}], response_format=list)
+            async with llm_semaphore:
+                response = await llm_client.achat_completion([{"role": "user", "content": prompt}], response_format=list)
             
             if not isinstance(response, list):
                  # Fallback parsing
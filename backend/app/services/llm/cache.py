@@ -0,0 +1,52 @@
+import hashlib
+import json
+import os
+from typing import Any, Optional
+from diskcache import Cache
+from app.core.logging import get_logger
+
+logger = get_logger("llm_cache")
+
+CACHE_DIR = "./.llm_cache"
+
+class LLMCache:
+    """
+    Persistent on-disk cache for LLM completions.
+
+    Responses are keyed by sha256(model || messages || response_format ||
+    temperature), so replaying the same pipeline (re-analyzing the same Excel
+    during dev, re-clustering on retry) hits the cache instead of the network.
+    Set LLM_CACHE_DISABLED=1 to bypass it entirely.
+    """
+
+    def __init__(self):
+        self.enabled = os.getenv("LLM_CACHE_DISABLED", "").lower() not in {"1", "true", "yes"}
+        self._cache = Cache(CACHE_DIR) if self.enabled else None
+
+    def make_key(self, model: str, messages: list, response_format: Any, temperature: float) -> str:
+        payload = "||".join([
+            model,
+            json.dumps(messages, ensure_ascii=False, sort_keys=True),
+            str(response_format),
+            str(temperature),
+        ])
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[Any]:
+        if not self.enabled:
+            return None
+        try:
+            return self._cache.get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache read failed: {e}")
+            return None
+
+    def set(self, key: str, value: Any) -> None:
+        if not self.enabled:
+            return
+        try:
+            self._cache.set(key, value)
+        except Exception as e:
+            logger.warning(f"LLM cache write failed: {e}")
+
+llm_cache = LLMCache()
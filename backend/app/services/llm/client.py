@@ -1,19 +1,44 @@
 import json
 import asyncio
 from typing import Any, Dict, Optional, Type
+import httpx
 from zhipuai import ZhipuAI
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
 from app.core.config import settings
 from app.core.logging import get_logger
+from app.services.llm.cache import llm_cache
+from app.services.llm.concurrency import llm_semaphore, is_rate_limit_error
 from pydantic import BaseModel
 
 logger = get_logger("llm_client")
 
+def _report_rate_limited_retry(retry_state) -> None:
+    # Tenacity swallows 429s it retries away, so the adaptive semaphore would
+    # never see them (and would count the eventual success toward more
+    # permits). Report each rate-limited attempt before sleeping.
+    exc = retry_state.outcome.exception() if retry_state.outcome else None
+    if exc is not None and is_rate_limit_error(exc):
+        llm_semaphore.note_rate_limit()
+
+# One shared connection pool for every LLM call in the process. HTTP/2
+# multiplexes concurrent requests over a few keep-alive connections instead
+# of opening a fresh HTTP/1.1 connection per call, which matters once the
+# semaphore allows 20+ requests in flight.
+_http_client = httpx.Client(
+    http2=True,
+    limits=httpx.Limits(max_connections=256, max_keepalive_connections=64),
+    timeout=httpx.Timeout(settings.LLM_TIMEOUT, connect=5.0, read=120.0),
+)
+
 class LLMClient:
     def __init__(self):
-        self.client = ZhipuAI(api_key=settings.LLM_API_KEY)
+        self.client = ZhipuAI(api_key=settings.LLM_API_KEY, http_client=_http_client)
         self.model = settings.LLM_MODEL
         self.total_tokens = 0
+
+    def close(self):
+        """Close the shared HTTP connection pool (FastAPI shutdown hook)."""
+        _http_client.close()
         
     def _clean_json_string(self, content: str) -> str:
         """
@@ -69,6 +94,7 @@ class LLMClient:
         stop=stop_after_attempt(settings.LLM_MAX_RETRIES + 1),
         wait=wait_exponential(multiplier=1, min=2, max=10),
         retry=retry_if_exception_type(Exception), # Broad for now, can refine
+        before_sleep=_report_rate_limited_retry,
         reraise=True
     )
     def chat_completion(
@@ -77,6 +103,11 @@ class LLMClient:
         response_format: Optional[Type[BaseModel]] = None,
         temperature: float = settings.LLM_TEMPERATURE
     ) -> Dict[str, Any]:
+        cache_key = llm_cache.make_key(self.model, messages, response_format, temperature)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            return cached
+
         try:
             kwargs = {
                 "model": self.model,
@@ -84,42 +115,71 @@ class LLMClient:
                 "temperature": temperature,
                 "max_tokens": settings.LLM_MAX_TOKENS,
             }
-            
+
             # logger.debug(f"Calling LLM with messages: {messages}")
             response = self.client.chat.completions.create(**kwargs)
-            
+
             # Track tokens
             if hasattr(response, 'usage') and response.usage:
                 self.total_tokens += response.usage.total_tokens
-                
+
             content = response.choices[0].message.content
-            
+
             if response_format:
                 try:
                     json_str = self._clean_json_string(content)
-                    return json.loads(json_str)
+                    result = json.loads(json_str)
                 except json.JSONDecodeError as e:
                     logger.error(f"Failed to decode JSON: {content}")
                     raise e
-            
-            return content
+            else:
+                result = content
+
+            llm_cache.set(cache_key, result)
+            return result
 
         except Exception as e:
             logger.error(f"LLM Call failed: {e}")
             raise e
 
     async def achat_completion(
-        self, 
-        messages: list, 
+        self,
+        messages: list,
         response_format: Optional[Type[BaseModel]] = None,
         temperature: float = settings.LLM_TEMPERATURE
     ) -> Dict[str, Any]:
         """Async wrapper for chat_completion using asyncio.to_thread"""
         return await asyncio.to_thread(
-            self.chat_completion, 
-            messages=messages, 
-            response_format=response_format, 
+            self.chat_completion,
+            messages=messages,
+            response_format=response_format,
             temperature=temperature
         )
 
+    @retry(
+        stop=stop_after_attempt(settings.LLM_MAX_RETRIES + 1),
+        wait=wait_exponential(multiplier=1, min=2, max=10),
+        retry=retry_if_exception_type(Exception),
+        before_sleep=_report_rate_limited_retry,
+        reraise=True
+    )
+    def embeddings(self, texts: list) -> list:
+        """Embed a list of texts, batching to respect the provider's per-request limit."""
+        vectors = []
+        batch_size = 64
+        for i in range(0, len(texts), batch_size):
+            batch = texts[i:i + batch_size]
+            response = self.client.embeddings.create(
+                model=settings.LLM_EMBEDDING_MODEL,
+                input=batch,
+            )
+            if hasattr(response, 'usage') and response.usage:
+                self.total_tokens += response.usage.total_tokens
+            vectors.extend(item.embedding for item in response.data)
+        return vectors
+
+    async def aembeddings(self, texts: list) -> list:
+        """Async wrapper for embeddings using asyncio.to_thread"""
+        return await asyncio.to_thread(self.embeddings, texts)
+
 llm_client = LLMClient()
@@ -0,0 +1,96 @@
+import asyncio
+from typing import Any, Dict
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger("llm_concurrency")
+
+def is_rate_limit_error(exc: BaseException) -> bool:
+    """Best-effort 429 detection across SDK exception shapes."""
+    if getattr(exc, "status_code", None) == 429:
+        return True
+    text = str(exc)
+    return "429" in text or "rate limit" in text.lower() or "too many requests" in text.lower()
+
+class AdaptiveSemaphore:
+    """
+    Rate-limit-aware semaphore for LLM dispatch (AIMD).
+
+    Unbounded asyncio.gather floods the provider once a job has hundreds of
+    cases, and every 429 costs an exponential-backoff retry. Permits here are
+    adjusted additively/multiplicatively: each window of successful calls adds
+    one permit, any rate-limited call halves them. Used as an async context
+    manager around the LLM call; the exit hook observes the outcome. 429s the
+    client retries away internally never surface as exceptions here, so the
+    retry loop reports them via note_rate_limit() and the next exit applies
+    the backoff instead of counting the eventual success toward more permits.
+    """
+
+    def __init__(self, initial_permits: int = None, min_permits: int = 1, max_permits: int = 128, success_window: int = 10):
+        self._permits = initial_permits or settings.LLM_CONCURRENCY
+        self._min_permits = min_permits
+        self._max_permits = max_permits
+        self._success_window = success_window
+        self._active = 0
+        self._successes = 0
+        self._cond = None
+        self._pending_rate_limits = 0
+        self.rate_limit_hits = 0
+
+    def note_rate_limit(self) -> None:
+        """
+        Record a 429 observed mid-retry. Called from worker threads inside the
+        client's tenacity loop; the int increments are GIL-atomic and the
+        permit adjustment itself happens under the condition on exit.
+        """
+        self.rate_limit_hits += 1
+        self._pending_rate_limits += 1
+
+    def _condition(self) -> asyncio.Condition:
+        # Created lazily so the semaphore binds to the running event loop
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def __aenter__(self):
+        cond = self._condition()
+        async with cond:
+            while self._active >= self._permits:
+                await cond.wait()
+            self._active += 1
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        cond = self._condition()
+        async with cond:
+            self._active -= 1
+            rate_limited = self._pending_rate_limits > 0
+            self._pending_rate_limits = 0
+            if exc is not None and is_rate_limit_error(exc):
+                self.rate_limit_hits += 1
+                rate_limited = True
+            if rate_limited:
+                self._successes = 0
+                old = self._permits
+                self._permits = max(self._min_permits, self._permits // 2)
+                if self._permits != old:
+                    logger.warning(f"Rate limited; halving LLM concurrency {old} -> {self._permits}")
+            elif exc is None:
+                self._successes += 1
+                if self._successes >= self._success_window:
+                    self._successes = 0
+                    if self._permits < self._max_permits:
+                        self._permits += 1
+            cond.notify_all()
+        return False
+
+    def metrics(self) -> Dict[str, Any]:
+        return {
+            "permits": self._permits,
+            "active": self._active,
+            "rate_limit_hits": self.rate_limit_hits,
+        }
+
+# Shared across all LLM-calling services so the whole process stays under the
+# provider's rate cap regardless of which pipeline stage is dispatching.
+llm_semaphore = AdaptiveSemaphore()
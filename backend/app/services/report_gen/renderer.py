@@ -1,5 +1,5 @@
 import os
-from jinja2 import Environment, FileSystemLoader
+from jinja2 import Environment, FileSystemLoader, FileSystemBytecodeCache
 from datetime import datetime
 from app.services.llm.client import llm_client
 from typing import Dict, Any, List
@@ -7,7 +7,17 @@ from typing import Dict, Any, List
 class ReportGenerator:
     def __init__(self):
         template_dir = os.path.join(os.path.dirname(__file__), 'templates')
-        self.env = Environment(loader=FileSystemLoader(template_dir))
+        bytecode_dir = os.path.join(template_dir, '.jinja_cache')
+        os.makedirs(bytecode_dir, exist_ok=True)
+        # Template is compiled once here; auto_reload off + bytecode cache
+        # means renders never touch the compiler again.
+        self.env = Environment(
+            loader=FileSystemLoader(template_dir),
+            auto_reload=False,
+            optimized=True,
+            bytecode_cache=FileSystemBytecodeCache(bytecode_dir),
+        )
+        self._template = self.env.get_template('report.html')
 
     def generate_summary(self, stats: Dict, clusters: List, suspicious_cases: List = None) -> str:
         suspicious_info = ""
@@ -47,9 +57,8 @@ class ReportGenerator:
 
     def render_report(self, job_id: str, stats: Dict, defects: List, clusters: List, suspicious_cases: List, all_cases: List, output_path: str):
         summary = self.generate_summary(stats, clusters, suspicious_cases)
-        template = self.env.get_template('report.html')
-        
-        html_content = template.render(
+
+        html_content = self._template.render(
             job_id=job_id,
             generated_at=datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
             summary_text=summary,
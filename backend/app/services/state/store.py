@@ -0,0 +1,109 @@
+import json
+from typing import Any, Dict, List, Optional
+from cachetools import TTLCache
+import redis.asyncio as aioredis
+from app.core.config import settings
+from app.core.logging import get_logger
+
+logger = get_logger("job_store")
+
+# Completed jobs stay queryable for a day, then Redis reclaims the memory.
+JOB_TTL_SECONDS = 86400
+
+class JobStateStore:
+    """
+    Redis-backed job state (meta, logs, cancel flag).
+
+    Process-local dicts break under `uvicorn --workers N` because a status
+    poll can land on a worker that never saw the job, and they grow without
+    bound. State lives in Redis hashes/lists with a TTL instead; if Redis is
+    unreachable (local dev without the broker), the store degrades to
+    process-local dicts so single-worker runs keep working.
+    """
+
+    def __init__(self):
+        self._redis: Optional[aioredis.Redis] = None
+        self._redis_failed = False
+        # In-memory fallback when Redis is unavailable, TTL-bounded to mirror
+        # the Redis EXPIRE so a long-lived dev server doesn't leak job state
+        self._local_meta: "TTLCache[str, Dict[str, Any]]" = TTLCache(maxsize=10000, ttl=JOB_TTL_SECONDS)
+        self._local_logs: "TTLCache[str, List[str]]" = TTLCache(maxsize=10000, ttl=JOB_TTL_SECONDS)
+        self._local_cancel: "TTLCache[str, bool]" = TTLCache(maxsize=10000, ttl=JOB_TTL_SECONDS)
+
+    async def _conn(self) -> Optional[aioredis.Redis]:
+        if self._redis_failed:
+            return None
+        if self._redis is None:
+            try:
+                self._redis = aioredis.from_url(settings.CELERY_BROKER_URL, decode_responses=True)
+                await self._redis.ping()
+            except Exception as e:
+                logger.warning(f"Redis unavailable, falling back to in-memory job state: {e}")
+                self._redis = None
+                self._redis_failed = True
+                return None
+        return self._redis
+
+    def _meta_key(self, job_id: str) -> str:
+        return f"job:{job_id}:meta"
+
+    def _logs_key(self, job_id: str) -> str:
+        return f"job:{job_id}:logs"
+
+    def _cancel_key(self, job_id: str) -> str:
+        return f"job:{job_id}:cancel"
+
+    async def update_meta(self, job_id: str, fields: Dict[str, Any]) -> None:
+        conn = await self._conn()
+        if conn is None:
+            self._local_meta.setdefault(job_id, {}).update(fields)
+            return
+        key = self._meta_key(job_id)
+        # JSON-encode values so None and nested dicts round-trip through the hash
+        await conn.hset(key, mapping={k: json.dumps(v, ensure_ascii=False) for k, v in fields.items()})
+        await conn.expire(key, JOB_TTL_SECONDS)
+
+    async def get_meta(self, job_id: str) -> Optional[Dict[str, Any]]:
+        conn = await self._conn()
+        if conn is None:
+            meta = self._local_meta.get(job_id)
+            return dict(meta) if meta is not None else None
+        raw = await conn.hgetall(self._meta_key(job_id))
+        if not raw:
+            return None
+        return {k: json.loads(v) for k, v in raw.items()}
+
+    async def append_log(self, job_id: str, message: str) -> int:
+        """Append a log line and return the new log length (1-based sequence
+        number of the appended line), so live subscribers can skip lines they
+        already replayed from the store."""
+        conn = await self._conn()
+        if conn is None:
+            logs = self._local_logs.setdefault(job_id, [])
+            logs.append(message)
+            return len(logs)
+        key = self._logs_key(job_id)
+        length = await conn.rpush(key, message)
+        await conn.expire(key, JOB_TTL_SECONDS)
+        return length
+
+    async def get_logs(self, job_id: str) -> List[str]:
+        conn = await self._conn()
+        if conn is None:
+            return list(self._local_logs.get(job_id, []))
+        return await conn.lrange(self._logs_key(job_id), 0, -1)
+
+    async def request_cancel(self, job_id: str) -> None:
+        conn = await self._conn()
+        if conn is None:
+            self._local_cancel[job_id] = True
+            return
+        await conn.set(self._cancel_key(job_id), "1", ex=JOB_TTL_SECONDS)
+
+    async def is_cancel_requested(self, job_id: str) -> bool:
+        conn = await self._conn()
+        if conn is None:
+            return self._local_cancel.get(job_id, False)
+        return await conn.get(self._cancel_key(job_id)) == "1"
+
+job_store = JobStateStore()
@@ -43,24 +43,36 @@ export default function App() {
       if (!res.ok) throw new Error(`上传失败: ${res.status}`)
       const data = await res.json()
       setJobId(data.job_id)
-      pollStatus(data.job_id)
+      streamStatus(data.job_id)
     } catch (e: any) {
       setError(e.message)
     }
   }
 
-  const pollStatus = (id: string) => {
-    const timer = setInterval(async () => {
+  // SSE: the backend pushes each new log line once instead of the frontend
+  // re-fetching the full log list on a timer.
+  const streamStatus = (id: string) => {
+    let logs: string[] = []
+    const es = new EventSource(`${API_BASE}/jobs/status/${id}/stream`)
+    // A reconnect replays the full history, so start from scratch
+    es.onopen = () => { logs = [] }
+    es.onmessage = e => {
+      logs.push(e.data)
+      setStatus({ job_id: id, status: 'running', logs: [...logs] })
+    }
+    es.onerror = async () => {
+      // The server closes the stream once the job reaches a terminal status;
+      // confirm with one status fetch before letting EventSource reconnect.
       try {
         const res = await fetch(`${API_BASE}/jobs/status/${id}`)
         const data = await res.json()
         setStatus(data)
         if (data.status === 'completed' || data.status === 'failed' || data.status === 'unknown' || data.status === 'cancelled') {
-          clearInterval(timer)
+          es.close()
         }
       } catch {
       }
-    }, 2000)
+    }
   }
 
   const cancelJob = async () => {